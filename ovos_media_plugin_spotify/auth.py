@@ -1,9 +1,124 @@
 import os
+import threading
+import time
 from os.path import join
 
+import requests
+from ovos_utils.log import LOG
 from ovos_utils.oauth import OAuthTokenDatabase, OAuthApplicationDatabase
 from ovos_utils.xdg_utils import xdg_config_home
 from spotipy import SpotifyOAuth
+from spotipy.oauth2 import SpotifyOauthError
+
+AUTH_DIR = os.environ.get('SPOTIFY_SKILL_CREDS_DIR', f"{xdg_config_home()}/spotipy")
+SCOPES = ("user-library-read", "streaming", "playlist-read-private",
+          "user-top-read", "user-read-playback-state")
+SCOPE = " ".join(SCOPES)
+REDIRECT_URI = 'https://localhost:8888'
+TOKEN_ID = "ocp_spotify"
+
+_session = requests.Session()  # keep-alive connection for token refreshes
+_refresh_lock = threading.Lock()
+_refresher = None
+_token_cache = {}  # token_id: (token_info, cache expiration, monotonic clock)
+_TOKEN_CACHE_TTL = 600  # seconds
+_EXPIRY_BUFFER = 60  # seconds
+
+
+def _cache_token(token_info: dict):
+    # expires_at is a wall clock timestamp, convert it to a monotonic
+    # deadline so clock adjustments can not keep a stale token cached
+    ttl = min(token_info.get("expires_in", 3600) * 0.5, _TOKEN_CACHE_TTL,
+              token_info["expires_at"] - _EXPIRY_BUFFER - time.time())
+    _token_cache[TOKEN_ID] = (token_info, time.monotonic() + ttl)
+
+
+def get_cached_token() -> dict:
+    """ get the oauth token, only reading the token database when the cached copy is stale """
+    token_info, expiry_ts = _token_cache.get(TOKEN_ID, (None, 0))
+    if token_info and time.monotonic() < expiry_ts:
+        return token_info
+    # read only access, the context manager would write the file back on exit
+    token_info = OAuthTokenDatabase().get_token(TOKEN_ID)
+    if not token_info:
+        return None
+    if time.time() >= token_info["expires_at"] - _EXPIRY_BUFFER:
+        LOG.warning("SPOTIFY TOKEN EXPIRED")
+        token_info = refresh_oauth_token()
+    _cache_token(token_info)
+    return token_info
+
+
+def refresh_oauth_token() -> dict:
+    """ refresh the spotify oauth token and store it in the token database """
+    if not _refresh_lock.acquire(blocking=False):
+        # single flight, wait for the refresh already in progress
+        # and reuse its result instead of refreshing again
+        with _refresh_lock:
+            pass
+        token_info, _ = _token_cache.get(TOKEN_ID, (None, 0))
+        if token_info and time.time() < token_info["expires_at"] - _EXPIRY_BUFFER:
+            return token_info
+        return refresh_oauth_token()
+
+    try:
+        app = OAuthApplicationDatabase().get_application(TOKEN_ID)
+
+        # spotipy writes the refreshed token to its cache file
+        os.makedirs(AUTH_DIR, exist_ok=True)
+        am = SpotifyOAuth(scope=SCOPE,
+                          client_id=app["client_id"],
+                          client_secret=app["client_secret"],
+                          redirect_uri=REDIRECT_URI,
+                          cache_path=join(AUTH_DIR, 'token'),
+                          open_browser=False,
+                          requests_session=_session)
+
+        with OAuthTokenDatabase() as db:
+            token_info = db.get_token(TOKEN_ID)
+            token_info = am.refresh_access_token(token_info["refresh_token"])
+            db.add_token(TOKEN_ID, token_info)
+            LOG.info(f"{TOKEN_ID} oauth token refreshed")
+        _cache_token(token_info)
+    finally:
+        _refresh_lock.release()
+    return token_info
+
+
+class TokenRefresher(threading.Thread):
+    """ renews the oauth token in the background shortly before it expires """
+
+    def __init__(self, margin: int = 300):
+        super().__init__(daemon=True)
+        self.margin = margin  # seconds before expiration
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            wait = 60
+            try:
+                token_info = OAuthTokenDatabase().get_token(TOKEN_ID)
+                if token_info:
+                    wait = token_info["expires_at"] - self.margin - time.time()
+                    if wait <= 0:
+                        refresh_oauth_token()
+                        continue
+            except Exception as e:
+                LOG.error(f"failed to refresh {TOKEN_ID} oauth token: {e}")
+                wait = 60
+            self._stopped.wait(wait)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_token_refresher() -> TokenRefresher:
+    """ start the background token refresher, only one runs per process """
+    global _refresher
+    if _refresher is None:
+        _refresher = TokenRefresher()
+        _refresher.start()
+    return _refresher
 
 
 def main():
@@ -18,22 +133,19 @@ def main():
         After you have done that enter the information when prompted and follow
         the instructions given.
         """)
-    AUTH_DIR = os.environ.get('SPOTIFY_SKILL_CREDS_DIR', f"{xdg_config_home()}/spotipy")
-    SCOPE = 'user-library-read streaming playlist-read-private user-top-read user-read-playback-state'
-
     CLIENT_ID = input('YOUR CLIENT ID: ')
     CLIENT_SECRET = input('YOUR CLIENT SECRET: ')
-    REDIRECT_URI = 'https://localhost:8888'
-    TOKEN_ID = "ocp_spotify"
     PORT = 36536  # Oauth phal plugin
 
     os.makedirs(AUTH_DIR, exist_ok=True)
     am = SpotifyOAuth(scope=SCOPE, client_id=CLIENT_ID,
                       client_secret=CLIENT_SECRET, redirect_uri=REDIRECT_URI,
                       cache_path=join(AUTH_DIR, 'token'),
-                      open_browser=False)
+                      open_browser=False,
+                      requests_session=_session)
 
     with OAuthApplicationDatabase() as db:
+        previous_app = db.get_application(TOKEN_ID) or {}
         db.add_application(oauth_service=TOKEN_ID,
                            client_id=CLIENT_ID,
                            client_secret=CLIENT_SECRET,
@@ -42,9 +154,18 @@ def main():
                            callback_endpoint=f"http://0.0.0.0:{PORT}/auth/callback/{TOKEN_ID}",
                            scope=SCOPE)
 
-    code = am.get_auth_response()
-    am.get_access_token(code, as_dict=False)
-    token_info = am.validate_token(am.cache_handler.get_cached_token())
+    # reuse the token cached by a previous run of the same application,
+    # validate_token refreshes it if it is about to expire
+    token_info = None
+    if previous_app.get("client_id") == CLIENT_ID:
+        try:
+            token_info = am.validate_token(am.cache_handler.get_cached_token())
+        except SpotifyOauthError as e:  # revoked or otherwise unusable
+            LOG.warning(f"cached spotify token rejected, authorizing again: {e}")
+    if not token_info:
+        code = am.get_auth_response()
+        am.get_access_token(code, as_dict=False)
+        token_info = am.validate_token(am.cache_handler.get_cached_token())
 
     with OAuthTokenDatabase() as db:
         db.add_token(TOKEN_ID, token_info)
@@ -28,24 +28,18 @@ def main():
             print(f"{idx} - {d}")
         default = int(input("select default spotify device:"))
 
+    audio_backends = cfg.setdefault("Audio", {}).setdefault("backends", {})
+    audio_players = cfg.setdefault("media", {}).setdefault("audio_players", {})
     for idx, d in enumerate(devices):
-        if "media" not in cfg:
-            cfg["media"] = {}
-        if "audio_players" not in cfg["media"]:
-            cfg["media"]["audio_players"] = {}
-
+        key = f"spotify-{d}"
         if idx == default:
-            if "Audio" not in cfg:
-                cfg["Audio"] = {}
-            if "backends" not in cfg["Audio"]:
-                cfg["Audio"]["backends"] = {}
-            cfg["Audio"]["backends"]["spotify-" + d] = {
+            audio_backends[key] = {
                 "type": "ovos_spotify",
                 "identifier": d,
                 "active": True
             }
 
-        cfg["media"]["audio_players"]["spotify-" + d] = {
+        audio_players[key] = {
             "module": "ovos-media-audio-plugin-spotify",
             "identifier": d,
             "aliases": [d.replace("-", " ")],
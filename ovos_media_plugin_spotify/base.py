@@ -0,0 +1,226 @@
+import threading
+import time
+
+from ovos_utils.log import LOG
+
+from ovos_media_plugin_spotify.spotifyd import SpotifydHooks
+
+WAIT_BACKOFF = (2, 5, 15, 30)  # seconds, used while the track length is unknown
+STOP_TIMEOUT = 10  # seconds to wait for the pause command when stopping
+
+
+class SpotifyBackendMixin:
+    """
+        playback logic shared by the ovos-media and legacy audio backends
+    """
+
+    def _init_spotify(self):
+        # imported here so plugin discovery does not pay for spotipy/requests
+        # when the plugin is installed but not enabled
+        from ovos_media_plugin_spotify.auth import start_token_refresher
+        from ovos_media_plugin_spotify.spotify_client import get_shared_client
+
+        self.spotify = get_shared_client()
+        start_token_refresher()  # renew oauth token before it expires
+        self._low_vol = int(self.spotify.DEFAULT_VOLUME / 3)
+        self._high_vol = int(self.spotify.DEFAULT_VOLUME)
+        # serializes start_playback across the daemon playback threads
+        self._play_lock = threading.Lock()
+        self._track_info_cache = {}  # track uri: track info
+        self._paused = False
+        self._playing = False  # local playback state, avoids querying spotify
+        self._last_sync_ts = 0
+        self.device_name = self.config.get("identifier")  # device name in spotify
+        self.hooks = SpotifydHooks(bus=self.bus,
+                                   track_start_callback=self.on_track_start,
+                                   track_end_callback=self.on_track_end,
+                                   track_error_callback=self.on_track_error,
+                                   track_pause_callback=self.on_track_pause)
+
+    def _invalidate_devices(self):
+        """ a failed command may mean the device list changed, fetch it again """
+        self.spotify.refresh_devices()
+
+    def _get_own_device(self):
+        """ our entry in the spotify device list, None if it is not listed """
+        return self.spotify.get_device_by_name(self.device_name)
+
+    @property
+    def device(self):
+        dev = self._get_own_device()
+        return dev["id"] if dev else None
+
+    def _control(self, method, *args, **kwargs):
+        """ send a command to our device, a failure may mean the device id changed """
+        try:
+            future = method(*args, self.device, **kwargs)
+        except Exception:
+            self._invalidate_devices()
+            raise
+        if future is not None:  # debounced volume changes report failures via on_error
+            future.add_done_callback(self._on_control_done)
+        return future
+
+    def _on_control_done(self, future):
+        if not future.cancelled() and future.exception():
+            self._invalidate_devices()
+
+    def supported_uris(self):
+        if self._get_own_device() is None:
+            names = [d["name"] for d in self.spotify.devices]
+            LOG.warning(f"{self.device_name} not found in spotify devices: {names}")
+            return []
+        return ['spotify']
+
+    def on_track_start(self, uri: str = ""):
+        self._now_playing = uri or self._now_playing
+        self._paused = False
+        self._playing = True
+        self._last_sync_ts = time.monotonic()
+        # Indicate to audio service which track is being played
+        if self._track_start_callback:
+            # TODO why is it None sometimes?
+            if self._now_playing:
+                self._track_start_callback(self._now_playing)
+
+    def on_track_pause(self, uri: str = ""):
+        # paused from another spotify client, keep local state in sync
+        self._paused = True
+        self._playing = False
+
+    def on_track_end(self, uri: str = ""):
+        if not uri:
+            self.hooks.reset_metadata()
+        self._paused = False
+        self._playing = False
+        self._last_sync_ts = 0
+        if self._track_start_callback:
+            self._track_start_callback(None)
+
+    def on_track_error(self, uri: str = ""):
+        if not uri:
+            self.hooks.reset_metadata()
+        self._paused = False
+        self._playing = False
+        self._last_sync_ts = 0
+
+    def _start_playback(self):
+        self._track_info_cache.clear()
+        previous = self.hooks.finished
+        self.hooks.preload_uri(self._now_playing)
+        previous.set()  # release the waiter of the previous playback
+        self.on_track_start()
+        # daemon thread so play() does not block until the track ends
+        # and a waiting playback never holds up interpreter exit
+        threading.Thread(target=self._play_and_wait,
+                         args=(self._now_playing, self.hooks.finished),
+                         name="spotify-play", daemon=True).start()
+
+    def _play_and_wait(self, uri: str, finished: threading.Event):
+        try:
+            with self._play_lock:
+                if finished is not self.hooks.finished:
+                    return  # replaced before it started
+                self.spotify.play([uri], dev_id=self.device)
+            # the cached list predates playback and still shows the device inactive
+            self.spotify.refresh_devices()
+            self._wait_until_finished(finished)
+        except Exception as e:
+            LOG.error(f"spotify playback failed: {e}")
+            self._invalidate_devices()
+            if finished is self.hooks.finished:
+                self.on_track_error()
+
+    def _wait_until_finished(self, finished: threading.Event):
+        # spotifyd hooks signal when playback ends, only poll spotify
+        # as a sanity check in case no event arrives
+        checks = 0
+        while self._last_sync_ts > 0:
+            remaining = self.hooks.get_remaining_time()
+            if remaining:  # check again around half way to the end of the track
+                timeout = min(30, max(2, remaining / 2000))
+            else:
+                timeout = WAIT_BACKOFF[min(checks, len(WAIT_BACKOFF) - 1)]
+            checks += 1
+            if finished.wait(timeout=timeout):
+                if finished is not self.hooks.finished:
+                    return  # replaced by a new playback
+                if self._last_sync_ts > 0:  # stopped, not handled by a callback
+                    self.on_track_end()
+                return
+            dev = self._get_own_device()
+            if dev and not dev["is_active"]:
+                self.on_track_end()
+                return
+
+    def stop(self):
+        # there is no hard stop method
+        self._track_info_cache.clear()
+        future = self._control(self.spotify.pause)
+        # wait for the pause so it can not land after a following play
+        try:
+            future.result(timeout=STOP_TIMEOUT)
+        except Exception as e:
+            LOG.warning(f"spotify pause did not complete: {e}")
+        self.on_track_end()
+
+    def pause(self):
+        if self._playing:
+            self._paused = True
+            self._playing = False
+            self._control(self.spotify.pause)
+
+    def resume(self):
+        if self._paused:
+            self._paused = False
+            self._playing = True
+            self._control(self.spotify.resume)
+
+    def lower_volume(self):
+        if self._playing:
+            self._control(self.spotify.volume, self._low_vol,
+                          on_error=self._invalidate_devices)
+
+    def restore_volume(self):
+        if self._playing:
+            self._control(self.spotify.volume, self._high_vol,
+                          on_error=self._invalidate_devices)
+
+    def track_info(self):
+        """ Extract info of current track. """
+        uri = self.hooks.current_uri or self._now_playing
+        if not uri or not uri.startswith("spotify:track:"):
+            # track changes inside a playlist/album context are not seen here
+            return self.spotify.track_info()
+        if uri in self._track_info_cache:
+            return self._track_info_cache[uri]
+        info = self.spotify.track_info()
+        # spotify may still report the previous track right after a change
+        if info.get("uri") == uri:
+            self._track_info_cache = {uri: info}
+        return info
+
+    def shutdown(self):
+        super().shutdown()
+        self.hooks.finished.set()
+        self.spotify.close()
+
+    def get_track_length(self) -> int:
+        """
+        getting the duration of the audio in milliseconds
+        """
+        return self.hooks.get_track_length()
+
+    def get_track_position(self) -> int:
+        """
+        get current position in milliseconds
+        """
+        return self.hooks.get_track_position()
+
+    def set_track_position(self, milliseconds):
+        """
+        go to position in milliseconds
+          Args:
+                milliseconds (int): number of milliseconds of final position
+        """
+        # Not available in this plugin
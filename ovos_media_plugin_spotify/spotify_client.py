@@ -1,16 +1,20 @@
-import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from itertools import chain
 
 import requests
 import spotipy
-from ovos_utils.oauth import OAuthTokenDatabase, OAuthApplicationDatabase, get_oauth_token
-from ovos_utils import flatten_list
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from ovos_utils.log import LOG
-from ovos_utils.xdg_utils import xdg_config_home
 from requests.exceptions import HTTPError
-from spotipy import SpotifyOAuth
 from spotipy.oauth2 import SpotifyAuthBase
 
+from ovos_media_plugin_spotify.auth import TOKEN_ID, get_cached_token, refresh_oauth_token
+
 
 class NoSpotifyDevicesError(Exception):
     pass
@@ -24,59 +28,167 @@ class SpotifyNotAuthorizedError(Exception):
     pass
 
 
-OAUTH_TOKEN_ID = "ocp_spotify"
+OAUTH_TOKEN_ID = TOKEN_ID
 
+_shared_client = None
+_shared_client_lock = threading.Lock()
 
-class OVOSSpotifyCredentials(SpotifyAuthBase):
-    """ Oauth through ovos-backend-client"""
+# uri expansions run concurrently, bounded to keep clear of rate limits
+MAX_EXPAND_WORKERS = 8
+_expand_pool = ThreadPoolExecutor(max_workers=MAX_EXPAND_WORKERS,
+                                  thread_name_prefix="spotify-expand")
 
-    def __init__(self):
-        super().__init__(requests.Session())
+DEVICES_TTL = 60  # seconds
+DEVICES_EMPTY_TTL = 10  # seconds, also used before retrying a failed refresh
 
-    @staticmethod
-    def is_token_expired(token_info: dict):
-        return time.time() >= token_info["expires_at"]
+REPLAY_WINDOW = 5  # seconds, repeated play requests inside it are ignored
+VOLUME_DEBOUNCE = 0.2  # seconds, only the last volume of a burst is sent
 
-    @staticmethod
-    def get_access_token():
-        t = get_oauth_token(OAUTH_TOKEN_ID, auto_refresh=True)
-        # TODO auto_refresh flag not working
-        if OVOSSpotifyCredentials.is_token_expired(t):
-            LOG.warning("SPOTIFY TOKEN EXPIRED")
-            t = OVOSSpotifyCredentials.refresh_oauth()
-        return t["access_token"]
+TRACK_CACHE_TTL = 600  # seconds
+TRACK_CACHE_SIZE = 256
+_track_cache = {}  # (lookup, uri): (expiration timestamp, tracks)
+_track_cache_lock = threading.Lock()
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_CAP = 30  # seconds
+BACKOFF_JITTER = 0.5
+RETRY_AFTER_CAP = 60  # seconds
 
-    @staticmethod
-    def refresh_oauth():
-        AUTH_DIR = os.environ.get('SPOTIFY_SKILL_CREDS_DIR', f"{xdg_config_home()}/spotipy")
-        SCOPE = 'user-library-read streaming playlist-read-private user-top-read user-read-playback-state'
-        TOKEN_ID = "ocp_spotify"
 
-        with OAuthApplicationDatabase() as db:
-            app = db.get_application(TOKEN_ID)
+def retry_spotify_request(func):
+    """ retry spotify api calls on rate limiting and server errors
 
-        am = SpotifyOAuth(scope=SCOPE,
-                          client_id=app["client_id"],
-                          client_secret=app["client_secret"],
-                          redirect_uri='https://localhost:8888',
-                          cache_path=f"{AUTH_DIR}/token",
-                          open_browser=False)
+    uses truncated exponential backoff with jitter, or the server provided
+    Retry-After delay when present; a 401 forces an oauth token refresh
+    """
 
-        with OAuthTokenDatabase() as db:
-            token_info = db.get_token(TOKEN_ID)
-            token_info = am.refresh_access_token(token_info["refresh_token"])
-            db.add_token(TOKEN_ID, token_info)
-            LOG.info(f"{TOKEN_ID} oauth token  refreshed")
-        return token_info
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return func(*args, **kwargs)
+            except spotipy.SpotifyException as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                if e.http_status == 401:
+                    LOG.warning("spotify request unauthorized, refreshing oauth token")
+                    refresh_oauth_token()
+                    continue
+                if e.http_status not in RETRY_STATUS:
+                    raise
+                retry_after = (getattr(e, "headers", None) or {}).get("Retry-After")
+                if retry_after:
+                    # the server tells us exactly how long to back off
+                    delay = min(float(retry_after), RETRY_AFTER_CAP) + \
+                            random.uniform(0, BACKOFF_JITTER)
+                else:
+                    delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * \
+                            (1 + random.uniform(0, BACKOFF_JITTER))
+                if e.http_status == 429:
+                    LOG.info(f"spotify rate limit hit, retrying in {delay:.1f}s")
+                else:
+                    LOG.debug(f"spotify returned {e.http_status}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    return wrapper
+
+
+def _log_command_error(future):
+    if not future.cancelled() and future.exception():
+        LOG.error(f"spotify command failed: {future.exception()}")
+
+
+def background_command(func):
+    """ run a playback command on the client command thread, returns a Future
+
+    commands run one at a time in the order they were sent
+    """
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        future = self._cmd_pool.submit(func, self, *args, **kwargs)
+        future.add_done_callback(_log_command_error)
+        return future
+
+    return wrapper
+
+
+def cached_tracks(func):
+    """ cache tracklist lookups by uri for TRACK_CACHE_TTL seconds """
+
+    @wraps(func)
+    def wrapper(self, uri):
+        key = (func.__name__, uri)
+        now = time.monotonic()
+        hit = _track_cache.get(key)
+        if hit and hit[0] > now:
+            return hit[1]
+        tracks = func(self, uri)
+        with _track_cache_lock:
+            if len(_track_cache) >= TRACK_CACHE_SIZE:
+                for k in [k for k, v in _track_cache.items() if v[0] <= now]:
+                    _track_cache.pop(k)
+            if len(_track_cache) >= TRACK_CACHE_SIZE:
+                _track_cache.pop(next(iter(_track_cache)))  # oldest entry
+            _track_cache[key] = (now + TRACK_CACHE_TTL, tracks)
+        return tracks
+
+    return wrapper
+
+
+class OVOSSpotifyCredentials(SpotifyAuthBase):
+    """ Oauth through ovos-backend-client"""
+
+    def __init__(self, requests_session=None):
+        super().__init__(requests_session or requests.Session())
+
+    @staticmethod
+    def get_access_token():
+        t = get_cached_token()
+        if not t:
+            raise SpotifyNotAuthorizedError
+        return t["access_token"]
 
 
 class SpotifyClient:
+    # uri type: track ids of that collection
+    _EXPANDERS = {
+        # removed or unavailable playlist entries have no track
+        "playlist": lambda self, uri: (t["track"]["id"] for t in self.tracks_from_playlist(uri)["items"]
+                                       if t.get("track")),
+        "artist": lambda self, uri: (t["id"] for t in self.tracks_from_artist(uri)),
+        "album": lambda self, uri: (t["id"] for t in self.tracks_from_album(uri))
+    }
+
     def __init__(self):
         self._spotify = None
         self.dev_id = None
+        self._last_play = (None, None, 0)  # device, uris/context, timestamp
+        # single connection pool reused for every api call (keep-alive)
+        # only connection errors are retried here, error status codes are
+        # retried by retry_spotify_request so Retry-After can be honored
+        retry = Retry(total=3, connect=None, read=False,
+                      allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                      backoff_factor=0.3, respect_retry_after_header=False)
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(pool_connections=10,
+                                                    pool_maxsize=10,
+                                                    max_retries=retry))
+        # control commands do not block the caller for the http round trip
+        self._cmd_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spotify-cmd")
+        self._vol_lock = threading.Lock()
+        self._vol_timer = None
+        self._pending_vol = {}  # device id: (volume, error callback)
+        self._sent_vol = {}  # device id: last volume spotify accepted
 
         self.__device_list = None
-        self.__devices_fetched = 0
+        self.__devices_expire = 0
+        self.__devices_lock = threading.Lock()
+        self.__devices_by_id = {}
+        self.__devices_by_name = {}  # lower case name: device
+        self.__devices_by_type = {}  # lower case type: device
         self.DEFAULT_VOLUME = 90
 
     @property
@@ -93,112 +205,217 @@ class SpotifyClient:
         Returns:
             True if specified device is playing
         """
-        if self.spotify:
+        sp = self.spotify
+        if sp:
             try:
-                status = self.spotify.current_user_playing_track()
-                if not status['is_playing'] or dev_id is None:
-                    return status['is_playing']
+                # playback state includes the active device, one request
+                # answers both questions
+                status = retry_spotify_request(sp.current_playback)()
+                if not status or not status['is_playing']:
+                    return False
+                if dev_id is None:
+                    return True
 
                 # Verify it is playing on the given device
-                dev = self.get_device(dev_id)
-                return dev and dev['is_active']
-            except:
+                return (status.get('device') or {}).get('id') == dev_id
+            except Exception:
                 # Technically a 204 return from status() request means 'no track'
                 return False  # assume not playing
         return False
 
+    @background_command
+    @retry_spotify_request
     def next(self, dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         return self.spotify.next_track(dev_id)
 
+    @background_command
+    @retry_spotify_request
     def previous(self, dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         return self.spotify.previous_track(dev_id)
 
+    @background_command
+    @retry_spotify_request
     def pause(self, dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         return self.spotify.pause_playback(dev_id)
 
+    @background_command
+    @retry_spotify_request
     def resume(self, dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         return self.spotify.start_playback(dev_id)
 
-    def volume(self, volume, dev_id=None):
+    def volume(self, volume, dev_id=None, on_error=None):
+        """ set the volume, a burst of changes is coalesced into a single api call
+
+        on_error is called without arguments if the request fails
+        """
+        with self._vol_lock:
+            self._pending_vol[dev_id] = (volume, on_error)
+            if self._vol_timer:
+                self._vol_timer.cancel()
+            self._vol_timer = threading.Timer(VOLUME_DEBOUNCE, self._flush_volume)
+            self._vol_timer.daemon = True
+            self._vol_timer.start()
+
+    def _flush_volume(self):
+        with self._vol_lock:
+            pending, self._pending_vol = self._pending_vol, {}
+            self._vol_timer = None
+        for dev_id, (volume, on_error) in pending.items():
+            if self._sent_vol.get(dev_id) == volume:
+                continue  # already at this level
+            future = self._set_volume(volume, dev_id)
+            future.add_done_callback(
+                lambda f, dev_id=dev_id, volume=volume, on_error=on_error:
+                self._volume_done(f, dev_id, volume, on_error))
+
+    def _volume_done(self, future, dev_id, volume, on_error):
+        if not future.cancelled() and future.exception() is None:
+            self._sent_vol[dev_id] = volume
+            return
+        self._sent_vol.pop(dev_id, None)
+        if on_error is not None:
+            on_error()
+
+    @background_command
+    @retry_spotify_request
+    def _set_volume(self, volume, dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         return self.spotify.volume(volume, dev_id)
 
+    def close(self):
+        """ close pooled connections, they are reopened if the client is used again """
+        self._session.close()
+
     def load_credentials(self):
         """ Retrieve credentials from the backend and connect to Spotify """
         try:
-            creds = OVOSSpotifyCredentials()
-            self._spotify = spotipy.Spotify(client_credentials_manager=creds)
+            creds = OVOSSpotifyCredentials(requests_session=self._session)
+            self._spotify = spotipy.Spotify(client_credentials_manager=creds,
+                                            requests_session=self._session)
+            # warm the device cache while the caller carries on
+            threading.Thread(target=self._prefetch_devices, daemon=True).start()
         except(HTTPError, SpotifyNotAuthorizedError):
             LOG.error('Couldn\'t fetch spotify credentials')
 
+    def _prefetch_devices(self):
+        try:
+            self._ensure_devices()
+        except Exception as e:
+            LOG.debug(f"failed to prefetch spotify devices: {e}")
+
     @property
     def devices(self):
-        """ Devices, cached for 60 seconds """
-        if not self.spotify:
+        """ Devices, cached for 60 seconds (10 seconds if none were found) """
+        return self._ensure_devices()
+
+    def _ensure_devices(self):
+        """ fetch the device list and lookup indexes if they are stale """
+        sp = self.spotify
+        if not sp:
             return []  # No connection, no devices
-        now = time.time()
-        if not self.__device_list or (now - self.__devices_fetched > 60):
-            self.__device_list = self.spotify.devices().get('devices', [])
-            self.__devices_fetched = now
-        return self.__device_list
+        if time.monotonic() < self.__devices_expire:
+            return self.__device_list
+        with self.__devices_lock:  # concurrent callers wait for a single fetch
+            return self._fetch_devices(sp)
+
+    def _fetch_devices(self, sp):
+        now = time.monotonic()
+        if now < self.__devices_expire:
+            return self.__device_list  # fetched while waiting for the lock
+        # with a list to fall back on, do not sleep through retries under the lock
+        fetch = sp.devices if self.__device_list is not None else retry_spotify_request(sp.devices)
+        try:
+            devices = fetch().get('devices', [])
+        except (spotipy.SpotifyException, requests.RequestException) as e:
+            if self.__device_list is None:
+                raise
+            LOG.warning(f"failed to refresh spotify devices, using last known list: {e}")
+            self.__devices_expire = now + DEVICES_EMPTY_TTL
+            return self.__device_list
+        # lookup indexes, built before publishing so lock free readers
+        # never see a fresh expiration with stale indexes
+        by_id = {d["id"]: d for d in devices}
+        by_name = {}
+        by_type = {}
+        for d in devices:
+            by_name.setdefault(d["name"].lower(), d)
+            by_type.setdefault(d["type"].lower(), d)
+        self.__devices_by_id = by_id
+        self.__devices_by_name = by_name
+        self.__devices_by_type = by_type
+        self.__device_list = devices
+        self.__devices_expire = now + (DEVICES_TTL if devices else DEVICES_EMPTY_TTL)
+        return devices
+
+    def refresh_devices(self):
+        """ drop the cached device list, the next access fetches it again """
+        self.__devices_expire = 0
 
     def validate_device_id(self, dev_id):
-        found = False
-        for d in self.devices:
-            if d["id"] == dev_id:
-                found = True
-                break
-        if not found:
-            for d in self.devices:
-                if d["name"].lower() == dev_id.lower():
-                    dev_id = d["id"]
-                    found = True
-                    break
-        if not found:
-            for d in self.devices:
-                if d["type"].lower() == dev_id.lower():
-                    dev_id = d["id"]
-                    break
         if dev_id is None:
             raise NoSpotifyDevicesError
+        self._ensure_devices()
+        if dev_id in self.__devices_by_id:
+            return dev_id
+        # names and types are lower cased once, when the indexes are built
+        query = dev_id.lower()
+        dev = self.__devices_by_name.get(query) or self.__devices_by_type.get(query)
+        if dev:
+            return dev["id"]
         return dev_id
 
     def get_device(self, dev_id):
-        for d in self.devices:
-            if d["id"] == dev_id:
-                return d
-        return None
+        self._ensure_devices()
+        return self.__devices_by_id.get(dev_id)
+
+    def get_device_by_name(self, name):
+        """ device with the given name (case insensitive), None if not listed """
+        if not name:
+            return None
+        self._ensure_devices()
+        return self.__devices_by_name.get(name.lower())
 
     def play(self, uris=None, dev_id=None, context_uri=None):
         """ Start spotify playback and log any exceptions. """
+        if isinstance(uris, list) and len(uris) == 1:
+            uris = uris[0]
         if isinstance(uris, str) and uris.startswith("spotify:playlist:"):
             return self.start_playlist_playback(uris, dev_id=dev_id)
+        if isinstance(uris, str) and uris.startswith(("spotify:album:", "spotify:artist:")):
+            # let spotify queue the tracks server side instead of
+            # fetching the tracklist and sending every uri back
+            return self.play(dev_id=dev_id, context_uri=uris)
 
         dev_id = self.validate_device_id(dev_id)
 
+        request = context_uri or tuple(uris if isinstance(uris, list) else [uris])
+        last_dev, last_request, last_ts = self._last_play
+        if (dev_id, request) == (last_dev, last_request) and \
+                time.monotonic() - last_ts < REPLAY_WINDOW and self.is_playing(dev_id):
+            LOG.debug(f"already playing {request} on {dev_id}")
+            return
+
         if context_uri is None:
             if not isinstance(uris, list):
                 uris = [uris]
 
-            for idx, uri in enumerate(uris):
-                if uri.startswith("spotify:playlist:"):
-                    uris[idx] = ["spotify:track:" + t["track"]["id"] for t in self.tracks_from_playlist(uri)]
-                elif uri.startswith("spotify:artist:"):
-                    uris[idx] = ["spotify:track:" + t["id"] for t in self.tracks_from_artist(uri)]
-                elif uri.startswith("spotify:album:"):
-                    uris[idx] = ["spotify:track:" + t["id"] for t in self.tracks_from_album(uri)]
-
-            uris = flatten_list(uris)
+            # fetch the tracklists concurrently, map keeps the original order
+            # and dict.fromkeys drops tracks repeated across collections
+            uris = list(dict.fromkeys(chain.from_iterable(
+                u if isinstance(u, list) else (u,)
+                for u in _expand_pool.map(self._expand_uri, uris))))
 
         try:
             LOG.info(f'spotify_play: {dev_id}')
-            self.spotify.start_playback(device_id=dev_id, uris=uris, context_uri=context_uri)
+            retry_spotify_request(self.spotify.start_playback)(
+                device_id=dev_id, uris=uris, context_uri=context_uri)
 
             self.dev_id = dev_id
+            self._last_play = (dev_id, request, time.monotonic())
         except spotipy.SpotifyException as e:
             # TODO: Catch other conditions?
             if e.http_status == 403:
@@ -209,6 +426,14 @@ class SpotifyClient:
             LOG.exception(e)
             raise
 
+    def _expand_uri(self, uri):
+        """ expand playlist/artist/album uris into a list of track uris """
+        kind = uri.split(":", 2)[1] if uri.startswith("spotify:") else None
+        expand = self._EXPANDERS.get(kind)
+        if expand is None:
+            return uri
+        return [f"spotify:track:{track_id}" for track_id in expand(self, uri)]
+
     def start_playlist_playback(self, uri, name="playlist", dev_id=None):
         dev_id = self.validate_device_id(dev_id)
         dev = self.get_device(dev_id)
@@ -220,40 +445,50 @@ class SpotifyClient:
             LOG.info('No playlist found')
             raise PlaylistNotFoundError
 
+    @cached_tracks
     def tracks_from_playlist(self, playlist_id):
         playlist_id = playlist_id.replace("spotify:playlist:", "")
         return self.spotify.playlist_tracks(playlist_id)
 
+    @cached_tracks
     def tracks_from_artist(self, artist_id):
         # get top tracks
         # spotify:artist:3TOqt5oJwL9BE2NG9MEwDa
         top_tracks = self.spotify.artist_top_tracks(artist_id)
-        return [t for t in top_tracks["tracks"]]
+        return top_tracks["tracks"]
 
+    @cached_tracks
     def tracks_from_album(self, artist_id):
         # get top tracks
         # spotify:artist:3TOqt5oJwL9BE2NG9MEwDa
         top_tracks = self.spotify.album_tracks(artist_id)
-        return [t for t in top_tracks["items"]]
+        return top_tracks["items"]
 
     def track_info(self):
         """ Extract info of current track. """
         status = self.spotify.current_user_playing_track()
-        try:
-            artist = status['item']['artists'][0]['name']
-        except Exception:
-            artist = 'unknown'
-        try:
-            track = status['item']['name']
-        except Exception:
-            track = 'unknown'
-        try:
-            album = status['item']['album']['name']
-        except Exception:
-            album = 'unknown'
+        item = (status or {}).get('item')
+        if not item:
+            return {"album": 'unknown',
+                    "artist": 'unknown',
+                    "title": 'unknown',
+                    "uri": None}
+        artist = (item.get('artists') or [{}])[0].get('name', 'unknown')
+        track = item.get('name', 'unknown')
+        album = (item.get('album') or {}).get('name', 'unknown')
         return {"album": album,
                 "artist": artist,
-                "title": track}
+                "title": track,
+                "uri": item.get('uri')}
+
+
+def get_shared_client() -> SpotifyClient:
+    """ get the SpotifyClient shared by all backend instances """
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = SpotifyClient()
+    return _shared_client
 
 
 if __name__ == "__main__":
@@ -1,42 +1,74 @@
+import threading
 import time
 
 from ovos_bus_client.message import Message
 
+_URI_PREFIX = "spotify:track:"
+
 
 class SpotifydHooks:
     def __init__(self, bus,
                  track_start_callback=None,
                  track_end_callback=None,
-                 track_error_callback=None):
+                 track_error_callback=None,
+                 track_pause_callback=None):
         self.current_uri = None
         self._last_sync_ts = 0
         self._track_len = 0
         self._track_pos = 0
+        self._player_state = None  # last states sent to OCP
+        self._media_state = None
         self.bus = bus
+        self.finished = threading.Event()  # set when spotifyd ends/stops playback
 
         self.track_start_callback = track_start_callback
         self.track_end_callback = track_end_callback
         self.track_error_callback = track_error_callback
-
-        self.bus.on("spotifyd.start", self.on_spotify_start)
-        self.bus.on("spotifyd.play", self.on_spotify_play)
-        self.bus.on("spotifyd.pause", self.on_spotify_pause)
-        self.bus.on("spotifyd.stop", self.on_spotify_stop)
-        self.bus.on("spotifyd.load", self.on_spotify_load)
-        self.bus.on("spotifyd.end_of_track", self.on_spotify_end)
-        self.bus.on("spotifyd.change", self.on_spotify_change)
-        self.bus.on("spotifyd.preloading", self.on_spotify_preloading)
+        self.track_pause_callback = track_pause_callback
+
+        # spotifyd event type: handler
+        self._dispatch = {
+            "start": self.on_spotify_start,
+            "play": self.on_spotify_play,
+            "pause": self.on_spotify_pause,
+            "stop": self.on_spotify_stop,
+            "load": self.on_spotify_load,
+            "endoftrack": self.on_spotify_end,
+            "change": self.on_spotify_change,
+            "preloading": self.on_spotify_preloading
+        }
+        self.bus.on("spotifyd.event", self.on_spotifyd_event)
+        # per event topics sent by older copies of spotifyd_hooks.py
+        for event, handler in self._dispatch.items():
+            if event == "endoftrack":
+                event = "end_of_track"
+            self.bus.on(f"spotifyd.{event}", handler)
 
     def reset_metadata(self):
         self.current_uri = None
         self._last_sync_ts = 0
         self._track_len = 0
         self._track_pos = 0
+        self._player_state = None
+        self._media_state = None
+
+    def _emit_states(self, message: Message, player_state: int = None, media_state: int = None):
+        """ forward player/media state changes to OCP, skipping states already sent """
+        if player_state is not None and player_state != self._player_state:
+            self._player_state = player_state
+            self.bus.emit(message.forward("ovos.common_play.player.state",
+                                          {"state": player_state}))
+        if media_state is not None and media_state != self._media_state:
+            self._media_state = media_state
+            self.bus.emit(message.forward("ovos.common_play.media.state",
+                                          {"state": media_state}))
 
     def preload_uri(self, uri: str):
         self.reset_metadata()
+        # new event per playback, a waiter holding the previous one can tell it was replaced
+        self.finished = threading.Event()
         self.current_uri = uri
-        self._last_sync_ts = time.time()
+        self._last_sync_ts = time.monotonic()
 
     def get_track_length(self) -> int:
         """
@@ -50,29 +82,41 @@ class SpotifydHooks:
         """
         pos = self._track_pos or 0
         if self._last_sync_ts:  # add the elapsed time since last update of self._track_pos
-            pos += (time.time() - self._last_sync_ts) * 1000
+            pos += int((time.monotonic() - self._last_sync_ts) * 1000)
         if not self._track_len:
             self._track_len = pos
-        return min(pos, self._track_len)
+        return pos if pos < self._track_len else self._track_len
+
+    def get_remaining_time(self) -> int:
+        """
+        milliseconds left in the current track, 0 if the duration is unknown
+        """
+        if not self._track_len:
+            return 0
+        return max(0, self._track_len - self.get_track_position())
 
     ##################
     # spotifyd hooks
+    def on_spotifyd_event(self, message: Message):
+        handler = self._dispatch.get(message.data.get("type"))
+        if handler is not None:
+            handler(message)
+
     def on_spotify_start(self, message: Message):
-        self._last_sync_ts = time.time()
-        self.current_uri = "spotify:track:" + message.data["track_id"]
-        self._track_pos = message.data["position"]  # milliseconds
-        self.bus.emit(message.forward("ovos.common_play.media.state",
-                                      {"state": 2}))  # loading media
+        data = message.data
+        self._last_sync_ts = time.monotonic()
+        self.current_uri = _URI_PREFIX + data["track_id"]
+        self._track_pos = int(data.get("position") or 0)  # milliseconds
+        self._emit_states(message, media_state=2)  # loading media
 
     def on_spotify_play(self, message: Message):
-        self._last_sync_ts = time.time()
-        self.current_uri = "spotify:track:" + message.data["track_id"]
-        self._track_len = message.data["duration"]  # milliseconds
-        self._track_pos = message.data["position"]  # milliseconds
-        self.bus.emit(message.forward("ovos.common_play.player.state",
-                                      {"state": 1}))  # playing
-        self.bus.emit(message.forward("ovos.common_play.media.state",
-                                      {"state": 6}))  # buffered media
+        data = message.data
+        self._last_sync_ts = time.monotonic()
+        self.current_uri = _URI_PREFIX + data["track_id"]
+        self._track_len = int(data.get("duration") or 0)  # milliseconds
+        self._track_pos = int(data.get("position") or 0)  # milliseconds
+        self._emit_states(message, player_state=1,  # playing
+                          media_state=6)  # buffered media
         if self.track_start_callback is not None:
             self.track_start_callback(self.current_uri)
 
@@ -81,23 +125,25 @@ class SpotifydHooks:
         self._track_len = 0
         self._track_pos = 0
         self._last_sync_ts = 0
-        self.bus.emit(message.forward("ovos.common_play.media.state",
-                                      {"state": 1}))  # no media
-        self.bus.emit(message.forward("ovos.common_play.player.state",
-                                      {"state": 0}))  # stopped
+        self._emit_states(message, player_state=0,  # stopped
+                          media_state=1)  # no media
+        self.finished.set()
 
     def on_spotify_pause(self, message: Message):
-        self.current_uri = "spotify:track:" + message.data["track_id"]
-        self._track_len = message.data["duration"]  # milliseconds
-        self._track_pos = message.data["position"]  # milliseconds
+        data = message.data
+        self.current_uri = _URI_PREFIX + data["track_id"]
+        self._track_len = int(data.get("duration") or 0)  # milliseconds
+        self._track_pos = int(data.get("position") or 0)  # milliseconds
         self._last_sync_ts = 0
-        self.bus.emit(message.forward("ovos.common_play.player.state",
-                                      {"state": 2}))  # paused
+        self._emit_states(message, player_state=2)  # paused
+        if self.track_pause_callback is not None:
+            self.track_pause_callback(self.current_uri)
 
     def on_spotify_load(self, message: Message):
-        self._last_sync_ts = time.time()
-        self._track_pos = message.data["position"]  # milliseconds
-        self.current_uri = "spotify:track:" + message.data["track_id"]
+        data = message.data
+        self._last_sync_ts = time.monotonic()
+        self._track_pos = int(data.get("position") or 0)  # milliseconds
+        self.current_uri = _URI_PREFIX + data["track_id"]
 
     def on_spotify_preloading(self, message: Message):
         # when track is about to end we get info about next song
@@ -106,17 +152,17 @@ class SpotifydHooks:
 
     def on_spotify_end(self, message: Message):
         self._track_pos = self._track_len
-        self.bus.emit(message.forward("ovos.common_play.player.state",
-                                      {"state": 2}))  # paused
-        self.bus.emit(message.forward("ovos.common_play.media.state",
-                                      {"state": 7}))  # end of media
+        self._emit_states(message, player_state=2,  # paused
+                          media_state=7)  # end of media
         if self.track_end_callback is not None:
             self.track_end_callback(self.current_uri)
+        self.finished.set()
 
     def on_spotify_change(self, message: Message):
-        self.current_uri = "spotify:track:" + message.data["track_id"]
-        self._last_sync_ts = time.time()
-        self.bus.emit(message.forward("ovos.common_play.player.state",
-                                      {"state": 2}))  # paused
-        self.bus.emit(message.forward("ovos.common_play.media.state",
-                                      {"state": 2}))  # loading media
+        uri = _URI_PREFIX + message.data["track_id"]
+        self._last_sync_ts = time.monotonic()
+        if uri == self.current_uri:
+            return  # metadata refresh for the same track
+        self.current_uri = uri
+        self._emit_states(message, player_state=2,  # paused
+                          media_state=2)  # loading media